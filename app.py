@@ -1,16 +1,24 @@
 import streamlit as st
 import pandas as pd
+import os
 import re
-from rapidfuzz import fuzz
+import zlib
+import numpy as np
+from rapidfuzz import fuzz, process
 from io import BytesIO
 
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
 EXCEL_FILE = "MARA 30.12.25.xlsx"
+PARQUET_FILE = os.path.splitext(EXCEL_FILE)[0] + ".parquet"  # cleaned cache
 MATERIAL_CODE_COL = "Material"
 MATERIAL_NAME_COL = "Material Description"
 
+# Character n-gram prefilter: each name is summarized as a 256-bit bloom filter
+NGRAM_SIZE = 3
+BLOOM_WORDS = 4
+
 # --------------------------------------------------
 # PAGE SETUP
 # --------------------------------------------------
@@ -37,37 +45,156 @@ st.title("🔍 Material Similarity Search")
 # --------------------------------------------------
 # CLEANING FUNCTIONS
 # --------------------------------------------------
+# Punctuation and whitespace runs collapse to a single space in one pass.
+# Whitespace is spelled out as every character Python's \s matches (none lie above
+# U+3000): on Arrow strings the pattern runs on RE2, where \s is ASCII only
+WHITESPACE_CHARS = "".join(ch for ch in map(chr, range(0x3001)) if ch.isspace())
+SEPARATOR_PATTERN = "[–\\-/,()" + WHITESPACE_CHARS + "]+"
+SEPARATOR_RE = re.compile(SEPARATOR_PATTERN)
+
+# Stored with the Parquet cache so cleaned names from older cleaning code are not
+# reused; bump CLEANING_VERSION when clean_series changes beyond the pattern
+CLEANING_VERSION = 2
+CLEANING_KEY = f"{CLEANING_VERSION}-{zlib.crc32(SEPARATOR_PATTERN.encode()):08x}"
+
 def clean_text(text):
     """Clean and normalize text for comparison"""
     if pd.isna(text):
         return ""
-    text = str(text).upper()
-    text = re.sub(r"[–\-/,()]", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
+    return SEPARATOR_RE.sub(" ", str(text).upper()).strip()
+
+def clean_series(series):
+    """Vectorized clean_text for a whole column, with identical output"""
+    # Uppercase with Python's full case mapping (ß -> SS) like clean_text; Arrow's
+    # utf8_upper maps one code point at a time. The regex then runs on RE2.
+    return (
+        series.fillna("")
+        .astype(str)
+        .map(str.upper)
+        .astype("string[pyarrow]")
+        .str.replace(SEPARATOR_PATTERN, " ", regex=True)
+        .str.strip()
+    )
 
 # --------------------------------------------------
 # SIMILARITY FUNCTIONS
 # --------------------------------------------------
-def similarity_score(a, b, method="token_set"):
-    """Calculate similarity score using selected method"""
-    if method == "token_set":
-        return fuzz.token_set_ratio(a, b)
-    elif method == "token_sort":
-        return fuzz.token_sort_ratio(a, b)
-    elif method == "partial":
-        return fuzz.partial_ratio(a, b)
-    else:
-        return fuzz.ratio(a, b)
+SCORERS = {
+    "token_set": fuzz.token_set_ratio,
+    "token_sort": fuzz.token_sort_ratio,
+    "partial": fuzz.partial_ratio,
+    "simple": fuzz.ratio,
+}
+
+def ngram_bloom(text):
+    """Hash the character n-grams of a string into BLOOM_WORDS 64-bit words"""
+    mask = 0
+    for i in range(len(text) - NGRAM_SIZE + 1):
+        gram = text[i:i + NGRAM_SIZE].encode()
+        mask |= 1 << (zlib.crc32(gram) % (64 * BLOOM_WORDS))
+    return [(mask >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(BLOOM_WORDS)]
+
+def ngram_candidates(blooms, clean_query):
+    """Return rows sharing at least two query n-gram bits, or None if the query is too short"""
+    query_bloom = np.array(ngram_bloom(clean_query), dtype=np.uint64)
+    
+    # Count set bits, not distinct n-grams: colliding n-grams share a bit, and an
+    # exact match can never overlap on more bits than the query sets
+    query_bits = int(np.bitwise_count(query_bloom).sum())
+    if query_bits == 0:
+        return None
+    
+    overlap = np.bitwise_count(blooms & query_bloom).sum(axis=1)
+    return np.flatnonzero(overlap >= min(query_bits, 2))
+
+def sort_tokens(text):
+    """Sort the words of a string, as token_sort_ratio does before comparing"""
+    return " ".join(sorted(text.split()))
+
+def select_top_matches(scores, min_score, top_n):
+    """Return row positions of the best scores above the threshold, best first"""
+    candidates = np.flatnonzero(scores >= min_score)
+    
+    # Quickselect the top N in O(N) instead of sorting every survivor
+    if len(candidates) > top_n:
+        keep = np.argpartition(scores[candidates], len(candidates) - top_n)[-top_n:]
+        candidates = candidates[keep]
+    
+    # Highest score first; ties keep master order (~ reverses uint8 order, no negation overflow)
+    order = np.lexsort((candidates, ~scores[candidates]))
+    return candidates[order]
+
+# Cached per (query, method, prefilter) only, so moving the threshold or result
+# count sliders reuses the score vector; _df is not hashed since it comes from
+# the cached load_data()
+@st.cache_data(show_spinner=False, max_entries=64)
+def compute_scores(_df, clean_query, method="token_set", prefilter=False):
+    """Score every material against the query; rows skipped by the prefilter score 0"""
+    arrays = build_search_arrays(_df)
+    query, choices, scorer = clean_query, arrays["choices"], SCORERS.get(method, fuzz.ratio)
+    
+    # token_sort_ratio is ratio on sorted tokens; the choices are sorted up front
+    if method == "token_sort":
+        query, choices, scorer = sort_tokens(clean_query), arrays["sorted_choices"], fuzz.ratio
+    
+    # partial_ratio aligns substrings, so a match need not share any n-gram
+    candidates = None
+    if prefilter and method != "partial":
+        candidates = ngram_candidates(build_ngram_blooms(_df), clean_query)
+    
+    # cdist runs the whole comparison in C++ across all cores; scores are rounded
+    # to uint8 (0-100) to keep the arrays small through top-N selection
+    if candidates is None:
+        return process.cdist([query], choices, scorer=scorer, dtype=np.uint8, workers=-1)[0]
+    
+    scores = np.zeros(len(choices), dtype=np.uint8)
+    scores[candidates] = process.cdist(
+        [query], choices[candidates], scorer=scorer, dtype=np.uint8, workers=-1,
+    )[0]
+    return scores
+
+def find_similar_materials(df, clean_query, method="token_set", min_score=0, top_n=100, prefilter=False):
+    """Return the best matches for the query above the threshold, best first"""
+    scores = compute_scores(df, clean_query, method, prefilter)
+    arrays = build_search_arrays(df)
+    
+    # Only the top N rows are ever assembled back into a DataFrame
+    idx = select_top_matches(scores, min_score, top_n)
+    return pd.DataFrame({
+        MATERIAL_CODE_COL: arrays["codes"][idx],
+        MATERIAL_NAME_COL: arrays["names"][idx],
+        "SIMILARITY": scores[idx],
+    })
 
 # --------------------------------------------------
 # LOAD DATA (CACHED)
 # --------------------------------------------------
-@st.cache_data
+def read_parquet_cache(excel_mtime):
+    """Return the cleaned master from the Parquet cache, or None if it is stale or invalid"""
+    if not os.path.exists(PARQUET_FILE) or os.path.getmtime(PARQUET_FILE) < excel_mtime:
+        return None
+    try:
+        df = pd.read_parquet(PARQUET_FILE)
+    except Exception:
+        return None
+    
+    # Written by different cleaning code, or missing columns: rebuild from Excel
+    required = {MATERIAL_CODE_COL, MATERIAL_NAME_COL, "CLEAN_NAME"}
+    if df.attrs.get("cleaning_key") != CLEANING_KEY or not required.issubset(df.columns):
+        return None
+    return df
+
+# cache_resource hands every rerun the same frame; cache_data would unpickle a full
+# copy of the master each time. The search path never mutates it.
+@st.cache_resource
 def load_data():
-    """Load and preprocess Excel data"""
+    """Load and preprocess Excel data, reusing the Parquet cache when it is fresh"""
     try:
-        df = pd.read_excel(EXCEL_FILE)
+        cached = read_parquet_cache(os.path.getmtime(EXCEL_FILE))
+        if cached is not None:
+            return cached
+        
+        df = pd.read_excel(EXCEL_FILE, engine="calamine")
         
         # Validate required columns
         if MATERIAL_CODE_COL not in df.columns or MATERIAL_NAME_COL not in df.columns:
@@ -75,11 +202,18 @@ def load_data():
             return None
         
         # Clean and prepare data
-        df["CLEAN_NAME"] = df[MATERIAL_NAME_COL].apply(clean_text)
+        df["CLEAN_NAME"] = clean_series(df[MATERIAL_NAME_COL])
         
         # Remove duplicates and empty names
         df = df[df["CLEAN_NAME"] != ""].drop_duplicates(subset=[MATERIAL_CODE_COL])
         
+        # Cache the cleaned frame; a failed write only costs the speedup
+        try:
+            df.attrs["cleaning_key"] = CLEANING_KEY
+            df.to_parquet(PARQUET_FILE)
+        except Exception:
+            pass
+        
         return df
     except FileNotFoundError:
         st.error(f"❌ File '{EXCEL_FILE}' not found. Please ensure the file is in the same directory.")
@@ -88,6 +222,25 @@ def load_data():
         st.error(f"❌ Error loading file: {str(e)}")
         return None
 
+# Built once per process alongside the cached master frame
+@st.cache_resource(show_spinner=False)
+def build_search_arrays(_df):
+    """Split the columns used on the search path into contiguous NumPy arrays"""
+    choices = _df["CLEAN_NAME"].to_numpy()
+    return {
+        "codes": _df[MATERIAL_CODE_COL].to_numpy(),
+        "names": _df[MATERIAL_NAME_COL].to_numpy(),
+        "choices": choices,
+        "sorted_choices": np.array([sort_tokens(c) for c in choices], dtype=object),
+    }
+
+# Built on first use only, since the prefilter is off by default
+@st.cache_resource(show_spinner=False)
+def build_ngram_blooms(_df):
+    """Compute the n-gram bloom filter of every cleaned name as an (N, BLOOM_WORDS) array"""
+    choices = build_search_arrays(_df)["choices"]
+    return np.array([ngram_bloom(c) for c in choices], dtype=np.uint64).reshape(-1, BLOOM_WORDS)
+
 # --------------------------------------------------
 # LOAD DATA
 # --------------------------------------------------
@@ -132,6 +285,11 @@ max_results = st.sidebar.selectbox(
 with st.sidebar.expander("🔧 Advanced Options"):
     case_sensitive = st.checkbox("Case sensitive search", value=False)
     show_stats = st.checkbox("Show statistics", value=True)
+    use_prefilter = st.checkbox(
+        "Fast n-gram prefilter",
+        value=False,
+        help="Only score materials sharing character trigrams with the query. Faster on large masters, but may drop weak matches. Not used by the partial method."
+    )
     
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📊 Database Info")
@@ -162,16 +320,8 @@ if search_term and (search_button or True):  # Auto-search on type
     clean_query = clean_text(search_term) if not case_sensitive else search_term.strip()
     
     with st.spinner("Searching for matches..."):
-        # Calculate similarities
-        df_master["SIMILARITY"] = df_master["CLEAN_NAME"].apply(
-            lambda x: similarity_score(clean_query, x, match_method)
-        )
-        
-        # Filter and sort results
-        results = (
-            df_master[df_master["SIMILARITY"] >= min_similarity]
-            .sort_values("SIMILARITY", ascending=False)
-            .head(max_results)
+        results = find_similar_materials(
+            df_master, clean_query, match_method, min_similarity, max_results, use_prefilter
         )
     
     # --------------------------------------------------
@@ -253,17 +403,16 @@ if search_term and (search_button or True):  # Auto-search on type
     col1, col2 = st.columns(2)
     
     # Prepare export data
-    output_df = results[[MATERIAL_CODE_COL, MATERIAL_NAME_COL, "SIMILARITY"]].copy()
-    output_df.rename(columns={
+    output_df = results[[MATERIAL_CODE_COL, MATERIAL_NAME_COL, "SIMILARITY"]].rename(columns={
         MATERIAL_CODE_COL: "Material Code",
         MATERIAL_NAME_COL: "Material Name",
         "SIMILARITY": "Similarity (%)"
-    }, inplace=True)
+    })
     
     # Excel export
     with col1:
         buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
             output_df.to_excel(writer, index=False, sheet_name="Matches")
             
             # Add search info sheet
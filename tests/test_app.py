@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP_FILE = Path(__file__).resolve().parent.parent / "app.py"
+EXCEL_FILE = "MARA 30.12.25.xlsx"
+
+
+def run_search(query, prefilter):
+    at = AppTest.from_file(str(APP_FILE), default_timeout=300)
+    at.run()
+    next(cb for cb in at.checkbox if cb.label == "Fast n-gram prefilter").set_value(prefilter)
+    at.text_input[0].input(query)
+    at.run()
+    assert not at.exception
+    return at
+
+
+# Each of these queries has two trigrams that hash to the same bloom bit
+@pytest.mark.parametrize("query", ["ASSY", "SHOW", "PANE"])
+def test_prefilter_keeps_exact_matches_for_colliding_ngrams(query):
+    at = run_search(query, prefilter=True)
+    assert at.dataframe, "prefilter dropped every match"
+    assert at.dataframe[0].value["Score"].iloc[0].endswith(" 100%")
+
+
+def test_stale_parquet_cache_is_rebuilt():
+    run_search("BEARING", prefilter=False)  # make sure the cache file exists
+    parquet_file = APP_FILE.parent / (Path(EXCEL_FILE).stem + ".parquet")
+
+    # Simulate a cache written by older cleaning code
+    stale = pd.read_parquet(parquet_file)
+    stale["CLEAN_NAME"] = "STALE"
+    stale.attrs["cleaning_key"] = "0-00000000"
+    stale.to_parquet(parquet_file)
+
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    at = run_search("BEARING", prefilter=False)
+    assert at.dataframe
+    assert pd.read_parquet(parquet_file)["CLEAN_NAME"].ne("STALE").all()